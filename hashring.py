@@ -35,14 +35,22 @@
 可以说Consistent Hashing 是分布式系统负载均衡的首选算法
 '''
 
+import array
 import sys
+from bisect import bisect, bisect_left
 
-if sys.version_info >= (2, 5):
-    import hashlib
-    md5_constructor = hashlib.md5
-else:
-    import md5
-    md5_constructor = md5.new
+import xxhash
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Ring keys are 64 bit, the top bits of a key select its bucket. The table
+# gets about BUCKETS_PER_POINT buckets per ring point, within these bounds.
+BUCKETS_PER_POINT = 8
+MIN_BUCKET_BITS = 10
+MAX_BUCKET_BITS = 20
 class HashRing(object):
     def __init__(self, nodes=None, replicas=3):
         """Manages a hash ring.
@@ -52,65 +60,253 @@ class HashRing(object):
         """
         self.replicas = replicas
         self.ring = dict()
-        self._sorted_keys = []
+        self._sorted_keys = array.array('Q')
+        self._node_keys = dict()
+        self._nodes_by_pos = []
+        self._buckets = None
+        self._version = 0
         if nodes:
+            keys = []
             for node in nodes:
-                self.add_node(node)
+                keys.extend(self._place_node(node))
+            keys.sort()
+            self._sorted_keys.extend(keys)
+            self._nodes_by_pos = [self.ring[key] for key in self._sorted_keys]
     def add_node(self, node):
         """Adds a `node` to the hash ring (including a number of replicas).
         """
-        for i in range(0, self.replicas):
-            key = self.gen_key('%s:%s' % (node, i))
+        for key in self._place_node(node):
+            pos = bisect(self._sorted_keys, key)
+            self._sorted_keys.insert(pos, key)
+            self._nodes_by_pos.insert(pos, self.ring[key])
+        self._version += 1
+        self._buckets = None
+    def _place_node(self, node):
+        """Maps the replica keys of `node` in the ring and returns them,
+        string nodes are interned so every replica shares one object.
+        The caller is responsible for keeping `_sorted_keys` in order
+        and `_nodes_by_pos` aligned with it.
+        """
+        if type(node) is str:
+            node = sys.intern(node)
+        keys = self._gen_replica_keys(node)
+        for key in keys:
+            if type(key) is not int or not 0 <= key < 1 << 64:
+                raise ValueError('gen_key must return an int in '
+                                 '[0, 2**64), got %r' % (key,))
+        self._node_keys[node] = keys
+        for key in keys:
             self.ring[key] = node
-            self._sorted_keys.append(key)
-        self._sorted_keys.sort()
+        return keys
     def remove_node(self, node):
         """Removes `node` from the hash ring and its replicas.
         """
-        for i in range(0, self.replicas):
-            key = self.gen_key('%s:%s' % (node, i))
+        for key in self._node_keys.pop(node):
             del self.ring[key]
-            self._sorted_keys.remove(key)
+            pos = bisect_left(self._sorted_keys, key)
+            del self._sorted_keys[pos]
+            del self._nodes_by_pos[pos]
+        self._version += 1
+        self._buckets = None
+    def _build_buckets(self):
+        """Splits the 64 bit key space in equal buckets, a power of two
+        sized to the ring, and returns `(shift, buckets)` where `buckets`
+        holds for each bucket the ring position every key in it maps to.
+        Buckets that contain a ring point are stored as -1 and have to be
+        resolved with a binary search.
+        The table is only kept if the ring did not change while building it.
+        """
+        version = self._version
+        keys = self._sorted_keys
+        n = len(keys)
+        bits = (BUCKETS_PER_POINT * n - 1).bit_length()
+        bits = min(max(bits, MIN_BUCKET_BITS), MAX_BUCKET_BITS)
+        shift = 64 - bits
+        width = 1 << shift
+        buckets = []
+        pos = 0
+        for i in range(0, 1 << bits):
+            lo = i << shift
+            while pos < n and keys[pos] <= lo:
+                pos += 1
+            if pos < n and keys[pos] < lo + width:
+                buckets.append(-1)
+            else:
+                buckets.append(pos % n)
+        table = (shift, buckets)
+        if self._version == version:
+            self._buckets = table
+        return table
+    def __getstate__(self):
+        """Copies the ring containers so a copy never shares them,
+        the bucket table is left out and rebuilt on the next `get_node`.
+        """
+        state = self.__dict__.copy()
+        state['ring'] = dict(self.ring)
+        state['_sorted_keys'] = array.array('Q', self._sorted_keys)
+        state['_node_keys'] = dict(self._node_keys)
+        state['_nodes_by_pos'] = list(self._nodes_by_pos)
+        state['_buckets'] = None
+        return state
     def get_node(self, string_key):
         """Given a string key a corresponding node in the hash ring is returned.
         If the hash ring is empty, `None` is returned.
         """
-        return self.get_node_pos(string_key)[0]
+        nodes = self._nodes_by_pos
+        if not nodes:
+            return None
+        table = self._buckets
+        if table is None:
+            table = self._build_buckets()
+        shift, buckets = table
+        key = self.gen_key(string_key)
+        pos = buckets[key >> shift]
+        if pos < 0:
+            pos = bisect(self._sorted_keys, key)
+            if pos == len(nodes):
+                pos = 0
+        return nodes[pos]
     def get_node_pos(self, string_key):
         """Given a string key a corresponding node in the hash ring is returned
         along with it's position in the ring.
         If the hash ring is empty, (`None`, `None`) is returned.
         """
-        if not self.ring:
+        nodes = self._nodes_by_pos
+        if not nodes:
             return None, None
-        key = self.gen_key(string_key)
-        nodes = self._sorted_keys
-        for i in range(0, len(nodes)):
-            node = nodes[i]
-            if key  <= node:
-                return self.ring[node], i
-        return self.ring[nodes[0]], 0
+        pos = bisect(self._sorted_keys, self.gen_key(string_key))
+        if pos == len(nodes):
+            pos = 0
+        return nodes[pos], pos
+    def get_nodes_batch(self, string_keys):
+        """Given a list of string keys it returns a list with the
+        corresponding node of every key, like calling `get_node` for each.
+        With numpy available all positions are found in one `searchsorted`.
+        If the hash ring is empty, a list of `None` is returned.
+        """
+        nodes = self._nodes_by_pos
+        if not nodes:
+            return [None] * len(string_keys)
+        if numpy is None:
+            return [self.get_node(string_key) for string_key in string_keys]
+        hashes = numpy.fromiter((self.gen_key(k) for k in string_keys),
+                                dtype=numpy.uint64, count=len(string_keys))
+        ring_keys = numpy.array(self._sorted_keys, dtype=numpy.uint64)
+        positions = numpy.searchsorted(ring_keys, hashes, side='right')
+        return [nodes[pos] for pos in (positions % len(nodes)).tolist()]
     def get_nodes(self, string_key):
         """Given a string key it returns the nodes as a generator that can hold the key.
         The generator is never ending and iterates through the ring
         starting at the correct position.
+        If the hash ring is empty, (`None`, `None`) is yielded once.
         """
         if not self.ring:
             yield None, None
-        node, pos = self.get_node_pos(string_key)
-        for key in self._sorted_keys[pos:]:
-            yield self.ring[key]
+            return
+        nodes = self._nodes_by_pos
+        pos = bisect(self._sorted_keys, self.gen_key(string_key)) % len(nodes)
         while True:
-            for key in self._sorted_keys:
-                yield self.ring[key]
+            yield nodes[pos]
+            pos = (pos + 1) % len(nodes)
     def gen_key(self, key):
         """Given a string key it returns a long value,
         this long value represents a place on the hash ring.
-        md5 is currently used because it mixes well.
+        It must be an int in [0, 2**64), an override that returns anything
+        else is rejected when nodes are added.
+        xxh64 is used since placement needs no cryptographic strength,
+        it is always used so every client maps keys the same way.
+        """
+        return xxhash.xxh64_intdigest(key.encode('utf8'))
+    def _gen_replica_keys(self, node):
+        """Returns the ring keys of all replicas of `node`, the same values
+        `gen_key('%s:%s' % (node, i))` would give, but the `node:` prefix
+        is encoded and fed to the hasher only once.
+        A subclass that overrides `gen_key` gets its replicas placed with it.
+        """
+        if type(self).gen_key is not HashRing.gen_key:
+            return [self.gen_key('%s:%s' % (node, i))
+                    for i in range(0, self.replicas)]
+        prefix = str(node).encode('utf8') + b':'
+        base = xxhash.xxh64(prefix)
+        keys = []
+        for i in range(0, self.replicas):
+            h = base.copy()
+            h.update(b'%d' % i)
+            keys.append(h.intdigest())
+        return keys
+
+def _is_prime(n):
+    """Returns whether `n` is an int (not a bool) that is a prime.
+    """
+    if type(n) is bool or not isinstance(n, int) or n < 2:
+        return False
+    d = 2
+    while d * d <= n:
+        if n % d == 0:
+            return False
+        d += 1
+    return True
+
+class MaglevHashRing(object):
+    def __init__(self, nodes=None, size=2053):
+        """Manages a Maglev lookup table.
+        `nodes` is a list of objects that have a proper __str__ representation.
+        `size` is the number of table entries and must be a prime,
+        a larger table gives a more even distribution.
+        """
+        if not _is_prime(size):
+            raise ValueError('size must be a prime, got %r' % (size,))
+        self.size = size
+        self.nodes = []
+        self.table = array.array('i', [-1] * size)
+        if nodes:
+            for node in nodes:
+                self.nodes.append(node)
+            self._populate()
+    def add_node(self, node):
+        """Adds a `node` to the table and repopulates it.
+        """
+        self.nodes.append(node)
+        self._populate()
+    def remove_node(self, node):
+        """Removes `node` from the table and repopulates it.
+        """
+        self.nodes.remove(node)
+        self._populate()
+    def get_node(self, string_key):
+        """Given a string key a corresponding node in the table is returned.
+        If the table is empty, `None` is returned.
+        """
+        if not self.nodes:
+            return None
+        return self.nodes[self.table[self.gen_key(string_key) % self.size]]
+    def _populate(self):
+        """Fills the table by letting every node claim the next free slot
+        of its own permutation in turn until no slot is left.
         """
-        m = md5_constructor()
-        m.update(key.encode('utf8'))
-        return m.hexdigest()
+        size = self.size
+        table = array.array('i', [-1] * size)
+        if self.nodes:
+            offsets = []
+            skips = []
+            for node in self.nodes:
+                offsets.append(self.gen_key('%s:offset' % (node,)) % size)
+                skips.append(self.gen_key('%s:skip' % (node,)) % (size - 1) + 1)
+            nexts = [0] * len(self.nodes)
+            filled = 0
+            while filled < size:
+                for i in range(len(self.nodes)):
+                    c = (offsets[i] + nexts[i] * skips[i]) % size
+                    while table[c] >= 0:
+                        nexts[i] += 1
+                        c = (offsets[i] + nexts[i] * skips[i]) % size
+                    table[c] = i
+                    nexts[i] += 1
+                    filled += 1
+                    if filled == size:
+                        break
+        self.table = table
+    gen_key = HashRing.gen_key
 
 '''
 下面是源代码
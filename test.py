@@ -1,4 +1,8 @@
-from hashring import HashRing
+from collections import Counter
+from itertools import islice
+
+import hashring
+from hashring import HashRing, MaglevHashRing
 json_dict = {
     '1':"{'NAME':'MYSQL','HOST':'192.16.1.21','USER':'ROOT','PASSWORD':'123456','PORT':3306}",
     '2':"{'NAME':'MYSQL','HOST':'192.16.1.22','USER':'ROOT','PASSWORD':'123456','PORT':3306}",
@@ -24,4 +28,45 @@ ring = HashRing(memcache_servers)
 server = ring.get_node('123456789')
 print(server)
 print(weights[server])
-print(type(server))
\ No newline at end of file
+print(type(server))
+
+def check_lookups_agree(ring, keys):
+    expected = [ring.get_node_pos(k)[0] for k in keys]
+    assert [ring.get_node(k) for k in keys] == expected
+    assert [HashRing.get_node(ring, k) for k in keys] == expected
+    assert [next(ring.get_nodes(k)) for k in keys] == expected
+    assert ring.get_nodes_batch(keys) == expected
+    numpy, hashring.numpy = hashring.numpy, None
+    try:
+        assert ring.get_nodes_batch(keys) == expected
+    finally:
+        hashring.numpy = numpy
+
+keys = ['key%d' % i for i in range(5000)]
+ring = HashRing(['node%d' % i for i in range(20)], replicas=40)
+check_lookups_agree(ring, keys)
+ring.add_node('node20')
+check_lookups_agree(ring, keys)
+ring.remove_node('node3')
+ring.remove_node('node7')
+check_lookups_agree(ring, keys)
+assert 'node3' not in ring.get_nodes_batch(keys)
+
+empty = HashRing()
+assert empty.get_node('key') is None
+assert list(islice(empty.get_nodes('key'), 3)) == [(None, None)]
+empty.add_node('node')
+assert empty.get_node('key') == 'node'
+empty.remove_node('node')
+assert empty.get_node('key') is None
+
+maglev = MaglevHashRing(['node%d' % i for i in range(5)])
+assert -1 not in maglev.table
+counts = Counter(maglev.table)
+assert max(counts.values()) - min(counts.values()) <= 1
+counts = Counter(maglev.get_node(k) for k in keys)
+assert min(counts.values()) > len(keys) / 5 * 0.8
+maglev.remove_node('node2')
+assert -1 not in maglev.table
+assert 'node2' not in [maglev.get_node(k) for k in keys]
+print('ok')